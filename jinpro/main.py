@@ -1,6 +1,164 @@
+import ast
+import copy
 import re
+import sys
+import tokenize
+from functools import lru_cache
+from io import StringIO
+
+from flask import before_render_template, template_rendered
+from jinja2 import TemplateNotFound
+
+# Pattern to match a single component tag, with named groups
+_PARSE_RE = re.compile(
+    r"<(?P<component>[A-Z]\w*)(?P<attributes>[^>]*)>(?P<content>.*?)</\1>", re.DOTALL
+)
+
+# Pattern to match the opening tag of a custom component, the closing tag is found with str.find
+_OPEN_TAG_RE = re.compile(r"<([A-Z]\w+)([^>]*)>")
+
+# Pattern to match the attributes comment on the first line of a component (used with .match, which anchors the start)
+_ATTR_LIST_RE = re.compile(r"\{# attributes (.*) #\}\Z")
+
+# Pattern to match attributes with or without values
+_ATTRIBUTES_RE = re.compile(r'([-\w]+)(?:="([^"]*)")?')
+
+# How many compiled page templates to keep around between renders
+_COMPILED_CACHE_SIZE = 256
+
+# How many rounds of nested components get expanded before giving up, so a component that
+# (directly or through others) renders itself raises instead of looping forever
+_MAX_EXPANSION_PASSES = 100
+
+# Default values of these types can be shared between calls, anything else (lists, dicts, ...) is copied per call
+_IMMUTABLE_DEFAULT_TYPES = (str, bytes, int, float, complex, bool)
+
+# Translation table for turning hyphens in attribute names into underscores
+_HYPHEN_TABLE = str.maketrans("-", "_")
+
+
+def _is_name_char(char):
+    """Mirrors Regex's \\w: letters, digits and underscores."""
+    return char.isalnum() or char == "_"
+
+
+def _split_attribute_list(text):
+    """Splits an attribute list on its top-level commas, so defaults like [1, 2] or "Hi, there" stay in one piece."""
+    pieces = []
+    depth = 0
+    start = 0
+    for token in tokenize.generate_tokens(StringIO(text).readline):
+        if token.type != tokenize.OP:
+            continue
+        if token.string in ("(", "[", "{"):
+            depth += 1
+        elif token.string in (")", "]", "}"):
+            depth -= 1
+        elif token.string == "," and depth == 0:
+            pieces.append(text[start : token.start[1]])
+            start = token.end[1]
+    pieces.append(text[start:])
+    return pieces
+
+
+def _may_have_components(html):
+    """Cheap check for a '<' followed by a capital letter, so HTML without any custom tags can skip the full scan."""
+    find = html.find
+    last = len(html) - 1
+    i = find("<")
+    while 0 <= i < last:
+        if "A" <= html[i + 1] <= "Z":
+            return True
+        i = find("<", i + 1)
+    return False
+
+
+def _scan_components(html):
+    """
+    Walks the HTML once and yields (start, end, component, attributes_text, content) for every outermost custom tag.
+
+    A custom tag starts with a capital letter, like <Button color="green">Click Me</Button>.
+    Tags of the same name nested inside each other are paired up properly, which a lazy Regex can't do.
+    """
+    find = html.find
+    search_open_tag = _OPEN_TAG_RE.search
+    i = 0
+
+    # component name -> earliest position with no closing tag anywhere after it,
+    # so a pile of unclosed tags of the same name doesn't search to the end of the document each time
+    unclosed_after = {}
+
+    while True:
+        opening = search_open_tag(html, i)
+        if not opening:
+            return
+        start = opening.start()
+        i = start + 1
+
+        component = opening.group(1)
+        open_tag = "<" + component
+        close_tag = "</" + component + ">"
+
+        # find the matching closing tag, counting any same-named tags opened along the way
+        depth = 1
+        pos = opening.end()
+        no_close_from = unclosed_after.get(component)
+        while depth:
+            if no_close_from is not None and pos >= no_close_from:
+                break
+            close = find(close_tag, pos)
+            if close < 0:
+                unclosed_after[component] = pos
+                break
+            nested = find(open_tag, pos, close)
+            while nested >= 0:
+                after = nested + len(open_tag)
+                if not _is_name_char(html[after]):
+                    depth += 1
+                nested = find(open_tag, after, close)
+            depth -= 1
+            pos = close + len(close_tag)
+
+        # no closing tag, so it's not a component after all
+        if depth:
+            continue
+
+        yield (
+            start,
+            pos,
+            component,
+            opening.group(2),
+            html[opening.end() : pos - len(close_tag)],
+        )
+        i = pos
+
+
+def _build_argument_filler(component, required, defaults, missing):
+    """
+    Generates a function that checks and fills in the arguments for one component.
+
+    The attribute names are written straight into the function's code, so calling it
+    is just a handful of 'in' checks instead of a loop over the attribute list.
+    """
+    namespace = {"_missing": missing, "_component": component, "_copy": copy.deepcopy}
+    lines = ["def fill_arguments(arguments):"]
+    for attr in required:
+        lines.append(
+            f"    if {attr!r} not in arguments: raise _missing(_component, {attr!r})"
+        )
+    for index, (attr, default) in enumerate(defaults.items()):
+        # defaults are handed over through the namespace rather than repr'd into the code
+        namespace[f"_default_{index}"] = default
+        # mutable defaults are copied, so a component changing its list doesn't change it for every later call
+        value = f"_default_{index}"
+        if not isinstance(default, _IMMUTABLE_DEFAULT_TYPES):
+            value = f"_copy({value})"
+        lines.append(f"    if {attr!r} not in arguments: arguments[{attr!r}] = {value}")
+    lines.append("    return arguments")
+
+    exec("\n".join(lines), namespace)
+    return namespace["fill_arguments"]
 
-from flask import render_template, render_template_string
 
 class JinjaProcessor:
     class MissingComponent(Exception):
@@ -31,6 +189,28 @@ class JinjaProcessor:
             self.template_name = template_name
             self.attribute = attribute
 
+    class ComponentNestingTooDeep(Exception):
+        """Exception raised when components keep producing more components, usually because one renders itself."""
+
+        def __init__(self, template_names):
+            super().__init__(
+                f"Components were still being expanded after {_MAX_EXPANSION_PASSES} levels of nesting. "
+                f"Check whether any of these render themselves, directly or through each other: {', '.join(template_names)}."
+            )
+            self.template_names = template_names
+
+    class CompiledTemplate:
+        """A page whose components have already been rendered, ready to be rendered again and again with different variables."""
+
+        def __init__(self, processor, template, source):
+            self.processor = processor
+            self.template = template
+            self.source = source
+
+        def render(self, **kwargs) -> str:
+            """Renders the pre-processed page with context variables, the same way JinjaProcessor.render does."""
+            return self.processor._render_compiled(self.template, kwargs)
+
     def __init__(self, app=None):
         if app:
             self.init(app)
@@ -39,6 +219,17 @@ class JinjaProcessor:
         self.app = app
         self.env = self.app.jinja_env
 
+        # template name -> (source, the loader's uptodate callable)
+        self._source_cache = {}
+
+        # component name -> ((required attribute names, defaults), argument filler, the source they were parsed from)
+        self._attr_cache = {}
+
+        # processed template source -> compiled Jinja template, so repeated renders skip parsing
+        self._compile_template = lru_cache(maxsize=_COMPILED_CACHE_SIZE)(
+            self.env.from_string
+        )
+
     def render(self, file: str, **kwargs) -> str:
         """Searches all template folders (in blueprints, and the global one), finds a .jinja file matching the name, and returns a processed/rendered component.
 
@@ -46,146 +237,227 @@ class JinjaProcessor:
             file (str): name of the file you want to render, like 'page.html'
 
         Returns:
-            rendered template: returns the results of Jinja's render_template_string evaluated on the component after pre-processing.
+            rendered template: returns the component after pre-processing, rendered the same way Flask's render_template_string would.
         """
         try:
-            template_source, _, _ = self.env.loader.get_source(self.env, file)
+            template_source = self._get_source(file)
 
             # Apply any custom processing to the template source
             processed_template = self.preprocess_components(template_source, **kwargs)
 
             # Render the processed template with context variables
-            return render_template_string(processed_template, **kwargs)
+            return self._render_compiled(
+                self._compile_template(processed_template), kwargs
+            )
         except AttributeError:
             raise AttributeError(
                 "'DeepRender' has no environment variable set. Did you forget to pass the 'app' object?\n\ndr = DeepRender(app)\n\nOR\n\ndr = DeepRender()\ndr.init(app)"
             )
 
+    def compile(self, file: str, **kwargs) -> "JinjaProcessor.CompiledTemplate":
+        """Pre-processes and compiles a template once, so it can be rendered many times without redoing that work.
+
+        Components are rendered right here, so they only see the variables passed to compile().
+        The variables passed to CompiledTemplate.render() are used for the rest of the page.
+
+        Args:
+            file (str): name of the file you want to compile, like 'layout.html'
+
+        Returns:
+            CompiledTemplate: call .render(**kwargs) on it to get the rendered page.
+        """
+        processed_template = self.preprocess_components(self._get_source(file), **kwargs)
+        return self.CompiledTemplate(
+            self, self.env.from_string(processed_template), processed_template
+        )
+
+    def _render_compiled(self, template, context):
+        """Renders an already compiled template the way Flask's render_template_string does: context processors and signals included."""
+        app = self.app
+        app.update_template_context(context)
+        before_render_template.send(
+            app, _async_wrapper=app.ensure_sync, template=template, context=context
+        )
+        rv = template.render(context)
+        template_rendered.send(
+            app, _async_wrapper=app.ensure_sync, template=template, context=context
+        )
+        return rv
+
     def preprocess_components(self, html, **kwargs):
         """
-        Uses Regex to find and replace all custom tags with their rendered versions.
+        Scans for and replaces all custom tags with their rendered versions.
+        The whole document is re-scanned until no custom tags are left, so nested components get rendered too.
 
         Takes raw HTML string and whatever other arguments were passed to the original render.
         """
 
-        # Pattern to match custom component tags
-        pattern = r"<([A-Z]\w+)([^>]*)>(.*?)</\1>"
-
-        # Use `re.finditer` to iterate over all matches of custom components
-        result = []
-        last_end = 0
-
-        for match in re.finditer(pattern, html, re.DOTALL):
-            # finds the first match, copies all html before, and adds it to the result array
-            result.append(html[last_end : match.start()])
-
-            # gets the full component match group
-            component_str = match.group(0)
+        # keep swapping components for their rendered versions until a pass finds none left
+        changed = True
+        passes = 0
+        while changed and _may_have_components(html):
+            changed = False
+            if passes == _MAX_EXPANSION_PASSES:
+                remaining = sorted({component for _, _, component, _, _ in _scan_components(html)})
+                if not remaining:
+                    break
+                raise self.ComponentNestingTooDeep(remaining)
+            passes += 1
+            result = StringIO()
+            last_end = 0
+
+            for start, end, component, attributes_text, content in _scan_components(html):
+                # copy all html before the component
+                result.write(html[last_end:start])
 
-            # try tp parse the component
-            parsed = self.parse_component(component_str)
-            if parsed:
                 # get string name of component and its arguments
-                component, arguments = parsed
-
-                # open file and get component's required attributes
-                attributes = self.get_component_attributes(component)
+                component, arguments = self._parse_component_parts(
+                    component, attributes_text, content
+                )
 
-                # flesh out arguments based on attributes, and ensure that all the needed ones are there
-                self.validate_and_complete_arguments(component, attributes, arguments)
+                # open file and get the component's argument filler, which fleshes out arguments
+                # based on attributes, and ensures that all the needed ones are there
+                _, fill_arguments = self._get_component_spec(component)
+                fill_arguments(arguments)
 
-                # process the component (yes recursion!)
-                processed_content = self.preprocess_components(
-                    self.render_template(component + ".jinja", **arguments, **kwargs),
-                    **kwargs,
+                # render the component in the page's context, any components inside it get picked up on the next pass
+                # (merged in one go, with the component's own arguments winning over page variables of the same name)
+                result.write(
+                    self._render_component(component + ".jinja", {**kwargs, **arguments})
                 )
-                # append the processed content to the HTML result array
-                result.append(processed_content)
-
-            last_end = match.end()
+                last_end = end
+                changed = True
 
-        # append the remaining HTML after the last match
-        result.append(html[last_end:])
+            if changed:
+                # append the remaining HTML after the last component
+                result.write(html[last_end:])
+                html = result.getvalue()
 
-        # convert array to string
-        return "".join(result)
+        return html
 
     def parse_component(self, text):
-        # Pattern to match the component tag
-        pattern = r"<(?P<component>[A-Z]\w*)(?P<attributes>[^>]*)>(?P<content>.*?)</\1>"
-        match = re.search(pattern, text, re.DOTALL)
+        match = _PARSE_RE.search(text)
         if not match:
             # returns a None if no match is found, but that (probably) would literally never happen
             return None
 
-        component = match.group("component")
-        attributes_text = match.group("attributes")
+        return self._parse_component_parts(*match.group("component", "attributes", "content"))
 
-        # if you try to use the keyword "content", it crashes
-        # because that's the reserved keyword for the stuff between the tags!
-        if "content" in attributes_text:
-            raise KeyError(
-                f"Reserved keyword 'content' used when calling {component}. Try changing the attribute name to 'text', 'material', or 'contents'."
-            )
+    def _parse_component_parts(self, component, attributes_text, content):
+        """Builds the component name and its arguments from the pieces of a component tag."""
+        # interned, so attribute cache lookups by component name can compare by identity
+        component = sys.intern(component)
 
-        # Updated pattern to match attributes with or without values
-        attributes_pattern = r'([-\w]+)(?:="([^"]*)")?'
         arguments = {}
-        for attr, value in re.findall(attributes_pattern, attributes_text):
+        for attr_match in _ATTRIBUTES_RE.finditer(attributes_text):
             # replace hyphens with underscores
             # HTML hates underscores (at least, my syntax highlighting does)
             # and python doesn't allow hyphens in variable names
             # so, 'active-link' in HTML will become 'active_link' in Jinja
-            attr = attr.replace("-", "_")
+            attr = attr_match.group(1)
+            if "-" in attr:
+                attr = attr.translate(_HYPHEN_TABLE)
+
+            # if you try to use the keyword "content", it crashes
+            # because that's the reserved keyword for the stuff between the tags!
+            if attr == "content":
+                raise KeyError(
+                    f"Reserved keyword 'content' used when calling {component}. Try changing the attribute name to 'text', 'material', or 'contents'."
+                )
+
+            value = attr_match.group(2)
             arguments[attr] = (
-                value if value else True
+                value if value is not None else True
             )  # assign True if nothing is provided, a la HTML :)
 
         # add the content (stuff between the tags) to arguments, stripping whitespace
-        arguments["content"] = match.group("content").strip()
+        arguments["content"] = content.strip()
 
         return component, arguments
 
+    def _get_source(self, name):
+        """Returns the source of a template, only going back to the loader when the file has changed since the last read."""
+        cached = self._source_cache.get(name)
+        if cached:
+            source, uptodate = cached
+            if uptodate is None or uptodate():
+                return source
+
+        source, _, uptodate = self.env.loader.get_source(self.env, name)
+        self._source_cache[name] = (source, uptodate)
+        return source
+
     def get_component_attributes(self, component_name):
+        """Returns a component's attribute list as (required attribute names, {attribute: default})."""
+        return self._get_component_spec(component_name)[0]
+
+    def _get_component_spec(self, component_name):
+        """Returns a component's attribute list along with the generated function that applies it to a call's arguments."""
         try:
             # load component file
-            jinja_env = self.env
-            template_source, _, _ = jinja_env.loader.get_source(
-                jinja_env, f"{component_name}.jinja"
-            )
-            first_line = template_source.splitlines()[0].strip()
+            template_source = self._get_source(f"{component_name}.jinja")
+        except Exception:
+            raise self.MissingAttributeList(component_name)
+
+        # reuse the parsed attributes as long as the component file hasn't changed
+        cached = self._attr_cache.get(component_name)
+        if cached and cached[2] is template_source:
+            return cached[0], cached[1]
+
+        try:
+            # only split off the first line, strip() takes care of a Windows '\r'
+            first_line = template_source.split("\n", 1)[0].strip()
 
             # look for the attributes comment
-            attribute_pattern = r"^\{# attributes (.*?) #\}$"
-            match = re.match(attribute_pattern, first_line)
+            match = _ATTR_LIST_RE.match(first_line)
             if not match:
                 raise self.MissingAttributeList(component_name)
 
             # parse attributes from the comment
-            attributes = {}
-            for attr_def in match.group(1).split(","):
+            required = []
+            defaults = {}
+            for attr_def in _split_attribute_list(match.group(1)):
                 attr_def = attr_def.strip()
                 if "=" in attr_def:
                     attr, default = attr_def.split("=", 1)
-                    attributes[attr.strip()] = eval(default.strip())
+                    default = ast.literal_eval(default.strip())
+                    if default is None:
+                        # a default of None still means the attribute is required
+                        required.append(sys.intern(attr.strip()))
+                    else:
+                        defaults[sys.intern(attr.strip())] = default
                 else:
-                    attributes[attr_def] = (
-                        None  # required attribute doesn't have a default value
-                    )
-
-            return attributes
+                    # required attribute doesn't have a default value
+                    required.append(sys.intern(attr_def))
         except Exception:
             raise self.MissingAttributeList(component_name)
 
-    def validate_and_complete_arguments(self, component, attributes, arguments):
-        for attr, default in attributes.items():
-            if attr not in arguments:
-                if default is None:
-                    raise self.MissingAttributeInCall(component, attr)
-                arguments[attr] = default
+        spec = (tuple(required), defaults)
+        fill_arguments = _build_argument_filler(
+            component_name, spec[0], defaults, self.MissingAttributeInCall
+        )
+        self._attr_cache[component_name] = (spec, fill_arguments, template_source)
+        return spec, fill_arguments
 
-    def render_template(self, name, **kwargs):
+    def validate_and_complete_arguments(self, component, spec, arguments):
+        """Checks and fills in arguments against the given (required attribute names, defaults) spec.
+
+        Builds a one-off argument filler for `spec`, so the rule lives in one place. preprocess_components uses the cached filler instead.
+        """
+        required, defaults = spec
+        _build_argument_filler(component, required, defaults, self.MissingAttributeInCall)(
+            arguments
+        )
+
+    def render_template(self, name, /, **kwargs):
+        return self._render_component(name, kwargs)
+
+    def _render_component(self, name, context):
+        """Renders a component file with the given context dict, which is used as-is rather than copied."""
         try:
-            return render_template(name, **kwargs)
-        except:
-            raise self.MissingComponent(name)
+            template = self.env.get_or_select_template(name)
+        except TemplateNotFound as e:
+            # only loading the component is covered here, errors from rendering it (like a missing include) go through untouched
+            raise self.MissingComponent(name) from e
+
+        return self._render_compiled(template, context)
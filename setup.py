@@ -16,7 +16,7 @@ setup(
         "Operating System :: OS Independent",
     ],
 
-    python_requires='>=3.6',  # Adjust based on compatibility
+    python_requires='>=3.8',  # Adjust based on compatibility
     install_requires=[  # Dependencies, if any
         'Flask>=3',
     ],
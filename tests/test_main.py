@@ -0,0 +1,157 @@
+import os
+
+import pytest
+from flask import Flask
+from jinja2 import TemplateNotFound
+
+from jinpro import JinjaProcessor
+
+
+@pytest.fixture
+def templates(tmp_path):
+    def write(name, source):
+        (tmp_path / name).write_text(source)
+
+    write("Card.jinja", '{# attributes content #}\n<div class="card">{{ content }}</div>')
+    write("Cards.jinja", "{# attributes content #}\n<ul>{{ content }}</ul>")
+    return write
+
+
+@pytest.fixture
+def processor(tmp_path, templates):
+    app = Flask(__name__, template_folder=str(tmp_path))
+    app.config["TEMPLATES_AUTO_RELOAD"] = True
+    jp = JinjaProcessor(app)
+    with app.app_context():
+        yield jp
+
+
+def test_same_name_nesting(processor):
+    html = processor.preprocess_components("<Card><Card>a</Card></Card>")
+    assert html == '\n<div class="card">\n<div class="card">a</div></div>'
+
+
+def test_prefixed_name_inside(processor):
+    html = processor.preprocess_components("<Card><Cards>b</Cards></Card>")
+    assert html == '\n<div class="card">\n<ul>b</ul></div>'
+
+
+def test_unclosed_tag_before_component(processor):
+    html = processor.preprocess_components("<Panel>never closed <Card>a</Card>")
+    assert html == '<Panel>never closed \n<div class="card">a</div>'
+
+
+def test_many_unclosed_tags_before_component(processor):
+    html = processor.preprocess_components("<Panel>" * 20000 + "<Card>a</Card>")
+    assert html == "<Panel>" * 20000 + '\n<div class="card">a</div>'
+
+
+def test_mutable_defaults_are_not_shared(processor, templates):
+    templates("Btn.jinja", "{# attributes content, items=[1] #}\n{% do items.append(9) %}{{ items }}")
+    processor.env.add_extension("jinja2.ext.do")
+    html = processor.preprocess_components("<Btn>a</Btn><Btn>b</Btn>")
+    assert html == "\n[1, 9]\n[1, 9]"
+    assert processor.preprocess_components("<Btn>c</Btn>") == "\n[1, 9]"
+
+
+def test_attribute_cache_invalidates_on_change(processor, templates, tmp_path):
+    templates("Button.jinja", "{# attributes content, color #}\n{{ color }}")
+    with pytest.raises(JinjaProcessor.MissingAttributeInCall):
+        processor.preprocess_components("<Button>go</Button>")
+
+    templates("Button.jinja", '{# attributes content, color="red" #}\n{{ color }}')
+    # make sure the change is visible even on filesystems with coarse mtimes
+    path = tmp_path / "Button.jinja"
+    mtime = os.path.getmtime(path) + 10
+    os.utime(path, (mtime, mtime))
+
+    assert processor.preprocess_components("<Button>go</Button>") == "\nred"
+
+
+def test_self_rendering_component_raises(processor, templates):
+    templates("Loop.jinja", "{# attributes content #}\n<Loop>x</Loop>")
+    with pytest.raises(JinjaProcessor.ComponentNestingTooDeep):
+        processor.preprocess_components("<Loop>x</Loop>")
+
+
+def test_content_in_attribute_name_is_allowed(processor, templates):
+    templates("Tag.jinja", "{# attributes content #}\n[{{ label }}|{{ data_content_id }}]")
+    html = processor.preprocess_components('<Tag data-content-id="x">y</Tag>')
+    assert html == "\n[|x]"
+
+
+def test_reserved_content_attribute_raises(processor, templates):
+    templates("Tag.jinja", "{# attributes content #}\n[{{ label }}|{{ data_content_id }}]")
+    with pytest.raises(KeyError):
+        processor.preprocess_components('<Tag content="x">y</Tag>')
+
+
+def test_empty_value_stays_empty_string(processor, templates):
+    templates("Tag.jinja", "{# attributes content #}\n[{{ label }}|{{ data_content_id }}]")
+    assert processor.preprocess_components('<Tag label="">y</Tag>') == "\n[|]"
+    assert processor.preprocess_components("<Tag label>y</Tag>") == "\n[True|]"
+
+
+def test_defaults_with_commas(processor, templates):
+    templates("List.jinja", '{# attributes content, items=[1, 2], label="Hi, there" #}\n{{ items }} {{ label }}')
+    assert processor.get_component_attributes("List") == (("content",), {"items": [1, 2], "label": "Hi, there"})
+    assert processor.preprocess_components("<List>y</List>") == "\n[1, 2] Hi, there"
+
+
+def test_attribute_named_name(processor, templates):
+    templates("Named.jinja", "{# attributes content, name #}\n{{ name }}")
+    assert processor.preprocess_components('<Named name="n">y</Named>', name="page") == "\nn"
+
+
+def test_render_applies_context_processors(processor, templates):
+    processor.app.context_processor(lambda: {"site": "Jinpro"})
+    templates("Site.jinja", "{# attributes content #}\n({{ site }})")
+    templates("page.html", "<h1>{{ site }}</h1><Site>x</Site>")
+    assert processor.render("page.html") == "<h1>Jinpro</h1>\n(Jinpro)"
+
+
+def test_missing_component(processor):
+    # the attribute list is looked up before rendering, so a missing file shows up there first
+    with pytest.raises(JinjaProcessor.MissingAttributeList):
+        processor.preprocess_components("<Nope>x</Nope>")
+    with pytest.raises(JinjaProcessor.MissingComponent):
+        processor.render_template("Nope.jinja")
+
+
+def test_errors_inside_component_propagate(processor, templates):
+    templates("Broken.jinja", "{# attributes content #}\n{{ 1 / 0 }}")
+    with pytest.raises(ZeroDivisionError):
+        processor.preprocess_components("<Broken>x</Broken>")
+
+    templates("Includes.jinja", '{# attributes content #}\n{% include "gone.html" %}')
+    with pytest.raises(TemplateNotFound) as excinfo:
+        processor.preprocess_components("<Includes>x</Includes>")
+    assert not isinstance(excinfo.value, JinjaProcessor.MissingComponent)
+
+
+def test_render_and_compile(processor, templates):
+    templates("Tag.jinja", "{# attributes content #}\n[{{ label }}]")
+    templates("page.html", "<h1>{{ title }}</h1><Tag>y</Tag>")
+    assert processor.render("page.html", title="Hi", label="L") == "<h1>Hi</h1>\n[L]"
+
+    # components are rendered at compile time, the rest of the page at render time
+    compiled = processor.compile("page.html", label="Built")
+    assert compiled.render(title="Now", label="Ignored") == "<h1>Now</h1>\n[Built]"
+
+
+def test_argument_filler(processor, templates):
+    templates("Btn.jinja", '{# attributes content, color, size="m" #}\n')
+    _, fill_arguments = processor._get_component_spec("Btn")
+    assert fill_arguments({"content": "x", "color": "red"}) == {"content": "x", "color": "red", "size": "m"}
+    assert fill_arguments({"content": "x", "color": "red", "size": "l"})["size"] == "l"
+    with pytest.raises(JinjaProcessor.MissingAttributeInCall) as excinfo:
+        fill_arguments({"content": "x"})
+    assert excinfo.value.attribute == "color"
+
+
+def test_validate_and_complete_arguments_uses_given_spec(processor):
+    arguments = {}
+    processor.validate_and_complete_arguments("Custom", ((), {"zz": 1}), arguments)
+    assert arguments == {"zz": 1}
+    with pytest.raises(JinjaProcessor.MissingAttributeInCall):
+        processor.validate_and_complete_arguments("Custom", (("a",), {}), {})